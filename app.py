@@ -1,11 +1,77 @@
 import streamlit as st
-import tempfile
-import fitz  # PyMuPDF
-import json
+import orjson
+import ast
+import re
+import hashlib
+import asyncio
+import threading
+import tiktoken
 from typing import List
+import os
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import httpx
 from litellm import completion
+from litellm.llms.custom_httpx.http_handler import HTTPHandler
+from pdf_worker import (
+    SECTION_END_RE,
+    SECTION_START_RE,
+    dedupe_targets,
+    draw_backdrops_bytes,
+    extract_pdf_text,
+    find_rects_in_pages,
+    highlight_pdf_bytes,
+    missing_targets,
+)
 
 # ---------- CONFIG ----------
+GROQ_MODEL = "groq/llama-3.1-8b-instant"
+# _llm_key already hashes the system prompt and the text, so prompt edits
+# never reuse cached replies. Bump this for request changes the key cannot
+# see: completion settings in _cached_llm (temperature, ...) or a new layout
+# of its messages. Reply parsing runs after the cache and needs no bump.
+PROMPT_VERSION = 1
+SYSTEM_PROMPT = '''
+                        You are a precise information extraction assistant. 
+                        Your goal is to read a person's CV text and extract only the **names of actual companies or organizations** where the person have worked. Don't include their education place or anything just the experience section where person have worked in a certain company
+                        
+                        Return only the company or organization names as a valid JSON array. Don't give nothing else 
+                        Do not include any explanations or extra text — the entire response must be valid JSON, for example:
+                        ['a', 'b']
+                        '''
+# Token budgets, measured with cl100k_base as a proxy for the Groq model's tokenizer
+MODEL_TOKEN_BUDGET = 1500  # per CV
+BATCH_TOKEN_BUDGET = 4500  # several CVs are packed into one request up to this
+# ...but never more than this many, beyond which per-CV extraction quality drops
+MAX_BATCH_DOCS = 8
+# Concurrent Groq requests, within the HTTP client's 16 keep-alive connections
+LLM_MAX_WORKERS = 8
+# PyMuPDF worker processes, and the page count from which one PDF is split across them
+PDF_WORKERS = min(os.cpu_count() or 4, 6)
+PARALLEL_PAGE_THRESHOLD = 24
+MIN_PAGES_PER_CHUNK = 8
+# Texts shorter than this (e.g. scanned PDFs without a text layer) skip the LLM call
+MIN_MODEL_CHARS = 30
+BATCH_SYSTEM_PROMPT = '''
+                        You are a precise information extraction assistant.
+                        You will receive several CVs, each starting with a label line such as "DOC1:".
+                        For every CV, extract only the **names of actual companies or organizations** where the person have worked. Don't include their education place or anything just the experience section where person have worked in a certain company
+
+                        Return a single valid JSON object mapping every label to a JSON array of names, for example:
+                        {"DOC1": ["a", "b"], "DOC2": []}
+                        Do not include any explanations or extra text — the entire response must be valid JSON.
+                        '''
+# Compiled once at import. The array pattern matches the first balanced [...]
+# (one nesting level, e.g. "Foo [UK]"), so trailing "[note]" chatter is ignored
+_JSON_ARRAY_RE = re.compile(r"\[[^\[\]]*(?:\[[^\[\]]*\][^\[\]]*)*\]")
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+# A work-history section runs from its heading (pdf_worker.SECTION_START_RE) to
+# the next section heading, or SECTION_MAX_CHARS past it, whichever is first
+SECTION_MAX_CHARS = 4000
+_ENC = tiktoken.get_encoding("cl100k_base")
+
 st.set_page_config(page_title="PDF Company Highlighter", layout="wide")
 
 st.title("PDF Company Highlighter (LiteLLM)")
@@ -15,69 +81,294 @@ st.write("Upload a CV PDF, extract company names from the text, and highlight th
 uploaded_files = st.file_uploader("Upload PDF(s)", type=["pdf"], accept_multiple_files=True)
 color_choice = st.selectbox("Backdrop color", ["red", "yellow", "green", "blue", "black"], index=0)
 opacity = st.slider("Backdrop opacity (0 = transparent, 1 = opaque)", 0.1, 0.9, 0.45)
+show_debug = st.checkbox("Show debug output", value=False)
 process = st.button("Process PDFs")
 
 # ---------- HELPERS ----------
+_COLOR_RGB = {
+    "black": (0, 0, 0),
+    "yellow": (1, 1, 0),
+    "red": (1, 0, 0),
+    "green": (0, 1, 0),
+    "blue": (0, 0, 1),
+}
+
 def color_to_rgb_tuple(color_name: str):
-    mapping = {
-        "black": (0, 0, 0),
-        "yellow": (1, 1, 0),
-        "red": (1, 0, 0),
-        "green": (0, 1, 0),
-        "blue": (0, 0, 1),
-    }
-    return mapping.get(color_name.lower(), (1, 0, 0))
+    return _COLOR_RGB.get(color_name.lower(), (1, 0, 0))
+
+@st.cache_resource
+def _groq_client() -> HTTPHandler:
+    """Keep-alive HTTP/2 client shared by every Groq call, so reruns reuse the connection.
+
+    LiteLLM's Groq route only reuses a client passed as `client=`.
+    """
+    return HTTPHandler(
+        client=httpx.Client(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+        )
+    )
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=64)
+def _cached_llm(model: str, key: str, prompt_version: int, _system: str, _text: str, _api_key: str) -> str:
+    """Run one extraction prompt once per (model, prompt+text hash, prompt version)."""
+    response = completion(
+        model=model,
+        messages=[
+            {"role": "system", "content": _system},
+            {"role": "user", "content": _text},
+        ],
+        api_key=_api_key,
+        temperature=0.0,
+        client=_groq_client(),
+    )
+    return response["choices"][0]["message"]["content"]
+
+def _llm_key(system: str, text: str) -> str:
+    return hashlib.blake2b(f"{system}\0{text}".encode(), digest_size=16).hexdigest()
+
+def _clean_companies(companies) -> List[str]:
+    if isinstance(companies, list):
+        return [c.strip() for c in companies if isinstance(c, str) and c.strip()]
+    return []
+
+def _parse_llm_json(content: str, pattern: "re.Pattern"):
+    """Decode the JSON value matched by `pattern`, or None if it does not parse.
+
+    The prompt's example uses Python list syntax, so single-quoted output
+    falls back to ast.literal_eval.
+    """
+    match = pattern.search(content)
+    if match is None:
+        return None
+    raw = match.group()
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        return None
 
 def call_groq_via_litellm(pdf_text: str, api_key: str) -> List[str]:
-    """Call Groq LLM via LiteLLM to extract company names as a JSON array."""
+    """Call Groq LLM via LiteLLM to extract company names as a JSON array.
+
+    Errors propagate to the caller so they can be reported per file.
+    """
+    key = _llm_key(SYSTEM_PROMPT, pdf_text)
+    content = _cached_llm(GROQ_MODEL, key, PROMPT_VERSION, SYSTEM_PROMPT, pdf_text, api_key)
+    return _clean_companies(_parse_llm_json(content, _JSON_ARRAY_RE))
+
+def call_groq_batch(texts: List[str], api_key: str) -> List:
+    """Extract companies for several CVs in one request.
+
+    Returns one list per input text, or None for any CV the reply did not
+    cover so the caller can retry it on its own.
+    """
+    labels = [f"DOC{i + 1}" for i in range(len(texts))]
+    user_msg = "\n\n".join(f"{label}:\n{text}" for label, text in zip(labels, texts))
+    key = _llm_key(BATCH_SYSTEM_PROMPT, user_msg)
+    content = _cached_llm(GROQ_MODEL, key, PROMPT_VERSION, BATCH_SYSTEM_PROMPT, user_msg, api_key)
+    parsed = _parse_llm_json(content, _JSON_OBJECT_RE)
+    if not isinstance(parsed, dict):
+        return [None] * len(texts)
+    return [_clean_companies(parsed[label]) if isinstance(parsed.get(label), list) else None for label in labels]
+
+def extract_experience_section(text: str) -> str:
+    """Return every work-history section of a CV joined together, or the whole text if there are none."""
+    sections = []
+    pos = 0
+    while (heading := SECTION_START_RE.search(text, pos)) is not None:
+        # A long section is cut at the cap, never skipped, so the next heading
+        # search resumes after it rather than at a later stray "career"
+        limit = min(heading.end() + SECTION_MAX_CHARS, len(text))
+        stop = SECTION_END_RE.search(text, heading.end(), limit)
+        pos = stop.start() if stop else limit
+        sections.append(text[heading.start():pos])
+    return "\n".join(sections) if sections else text
+
+def text_for_model(full_text: str) -> str:
+    """Clip the Experience section to MODEL_TOKEN_BUDGET tokens."""
+    ids = _ENC.encode(extract_experience_section(full_text))
+    return _ENC.decode(ids[:MODEL_TOKEN_BUDGET])
+
+def _batch_by_budget(sizes: List[int], budget: int, max_items: int) -> List[List[int]]:
+    """Group indices greedily so each group stays within `budget` total size and `max_items` entries."""
+    groups, current, total = [], [], 0
+    for i, size in enumerate(sizes):
+        if current and (total + size > budget or len(current) >= max_items):
+            groups.append(current)
+            current, total = [], 0
+        current.append(i)
+        total += size
+    if current:
+        groups.append(current)
+    return groups
+
+async def _call_single(text: str, api_key: str) -> tuple:
     try:
-        response = completion(
-            model="groq/llama-3.1-8b-instant",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        '''
-                        You are a precise information extraction assistant. 
-                        Your goal is to read a person's CV text and extract only the **names of actual companies or organizations** where the person have worked. Don't include their education place or anything just the experience section where person have worked in a certain company
-                        
-                        Return only the company or organization names as a valid JSON array. Don't give nothing else 
-                        Do not include any explanations or extra text — the entire response must be valid JSON, for example:
-                        ['a', 'b']
-                        '''
-                    )
-                },
-                {"role": "user", "content": pdf_text},
-            ],
+        companies = await asyncio.to_thread(call_groq_via_litellm, text, api_key)
+    except Exception as e:
+        return [], f"Groq LiteLLM error or JSON parsing error: {e}"
+    return companies, None
+
+async def _call_group(group_texts: List[str], api_key: str) -> List[tuple]:
+    batched = [None] * len(group_texts)
+    if len(group_texts) > 1:
+        try:
+            batched = await asyncio.to_thread(call_groq_batch, group_texts, api_key)
+        except Exception:
+            pass  # retried per file below
+    # Single-file fallback, concurrently, for CVs the batch reply did not cover
+    retry = [i for i, companies in enumerate(batched) if companies is None]
+    retried = await asyncio.gather(*[_call_single(group_texts[i], api_key) for i in retry])
+    results = [(companies, None) for companies in batched]
+    for i, result in zip(retry, retried):
+        results[i] = result
+    return results
+
+async def _call_groups(texts: List[str], groups: List[List[int]], api_key: str) -> List[List[tuple]]:
+    # Bound in-flight Groq requests; asyncio.run() shuts this executor down when done
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS))
+    return await asyncio.gather(*[_call_group([texts[i] for i in group], api_key) for group in groups])
+
+def extract_companies(texts: List[str], api_key: str) -> List[tuple]:
+    """Return `(companies, error)` per text, batching several CVs per LLM call.
+
+    All groups are sent concurrently on one event loop. The blocking, cached
+    completion runs via asyncio.to_thread because st.cache_data cannot
+    memoize coroutines, so litellm.acompletion would bypass the cache.
+    Texts too short to name a company get `([], None)` without a call.
+    """
+    usable = [i for i, t in enumerate(texts) if len(t.strip()) >= MIN_MODEL_CHARS]
+    sizes = [len(_ENC.encode(texts[i])) for i in usable]
+    groups = [[usable[j] for j in group] for group in _batch_by_budget(sizes, BATCH_TOKEN_BUDGET, MAX_BATCH_DOCS)]
+    results = [([], None)] * len(texts)
+    for group, group_results in zip(groups, asyncio.run(_call_groups(texts, groups, api_key))):
+        for i, result in zip(group, group_results):
+            results[i] = result
+    return results
+
+# Workers are forked, pinned rather than left to the platform default
+# (forkserver from Python 3.14). Streamlit runs this script as __main__, so
+# spawn/forkserver children would re-import and re-run the whole app. Forking
+# a threaded server is safe here because the parent never calls MuPDF, and
+# workers only run pdf_worker functions. Where fork does not exist (Windows),
+# the platform default is used.
+_POOL_CONTEXT = multiprocessing.get_context(
+    "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+)
+
+@st.cache_resource
+def _process_pool() -> ProcessPoolExecutor:
+    """PyMuPDF worker processes, shared across reruns so they start only once."""
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=_POOL_CONTEXT)
+
+def _on_pool(work):
+    """Return `work(pool)`, rebuilding the shared pool and retrying once if a worker died."""
+    pool = _process_pool()
+    try:
+        return work(pool)
+    except BrokenProcessPool:
+        # A crashed worker (segfault or OOM on a malformed PDF) breaks the
+        # executor for good, for every session, until it is replaced
+        pool.shutdown(wait=False, cancel_futures=True)
+        # Another thread may already have put a fresh pool in its place
+        if _process_pool() is pool:
+            _process_pool.clear()
+        return work(_process_pool())
+
+def _run_on_pool(fn, *args):
+    return _on_pool(lambda pool: pool.submit(fn, *args).result())
+
+DEBUG_PREVIEW_CHARS = 1000
+
+def _debug_preview(label: str, value: str) -> None:
+    """Collapsed, truncated debug output; keeps large strings off the websocket on every rerun."""
+    # Not mounted at all unless asked for
+    if not show_debug:
+        return
+    with st.expander(label, expanded=False):
+        truncated = len(value) > DEBUG_PREVIEW_CHARS
+        st.code(value[:DEBUG_PREVIEW_CHARS] + ("...[truncated]" if truncated else ""))
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _cached_pdf_extract(digest: str, _pdf_bytes: bytes) -> tuple:
+    """`(text, page count)` per PDF, keyed by the SHA-256 of its bytes so reruns skip PyMuPDF."""
+    return _run_on_pool(extract_pdf_text, _pdf_bytes)
+
+def highlight_job(pdf_bytes: bytes, page_count: int, targets: List[str], rgb_fill: tuple, opacity_val: float) -> bytes:
+    """Highlight one PDF on the process pool, sweeping large PDFs in page chunks on every worker."""
+    if page_count < PARALLEL_PAGE_THRESHOLD:
+        return _run_on_pool(highlight_pdf_bytes, pdf_bytes, targets, rgb_fill, opacity_val)
+
+    size = max(MIN_PAGES_PER_CHUNK, -(-page_count // PDF_WORKERS))
+    chunks = [list(range(start, min(start + size, page_count))) for start in range(0, page_count, size)]
+    page_rects, found, rejected = {}, set(), set()
+    swept = _on_pool(lambda pool: list(pool.map(find_rects_in_pages, repeat(pdf_bytes), chunks, repeat(targets))))
+    for rects, hits, rejects in swept:
+        page_rects.update(rects)
+        found |= hits
+        rejected |= rejects
+    # Drawing is cheap next to the sweep, so one worker applies every chunk's rects
+    missing = missing_targets(targets, found, rejected)
+    return _run_on_pool(draw_backdrops_bytes, pdf_bytes, page_rects, missing, rgb_fill, opacity_val)
+
+def render_result(name: str, text: str, companies: List[str], error, pdf_out) -> None:
+    _debug_preview(f"Debug: extracted text for {name}", text)
+
+    if len(text.strip()) < MIN_MODEL_CHARS:
+        # A file that could not be read at all has no text either; say why
+        if error:
+            st.error(error)
+        else:
+            st.warning(f"No text layer found in {name} (scanned PDF?), skipped company detection.")
+        return
+
+    if error:
+        st.error(error)
+    _debug_preview(f"Debug: detected companies for {name}", str(companies))
+
+    if not companies:
+        st.warning(f"No company names detected for {name}.")
+        return
+
+    st.write(f"**Detected companies:** {', '.join(companies)}")
+    if pdf_out is None:
+        return
+    st.download_button(
+        label=f"Download highlighted {name}",
+        data=pdf_out,
+        file_name=f"highlighted_{name}",
+        mime="application/pdf",
+    )
+
+def _warm_groq(api_key: str) -> None:
+    """Tiny request so the shared HTTP client holds a live Groq connection."""
+    try:
+        completion(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": "ping"}],
+            max_tokens=1,
             api_key=api_key,
-            temperature=0.0,
+            client=_groq_client(),
         )
-        content = response["choices"][0]["message"]["content"]
+    except Exception:
+        pass
 
-        # Parse LLM JSON response directly, no regex fallback
-        companies = json.loads(content)
-        if isinstance(companies, list):
-            return [c.strip() for c in companies if isinstance(c, str) and c.strip()]
-        return []
-    except Exception as e:
-        st.error(f"Groq LiteLLM error or JSON parsing error: {e}")
-        return []
-
-def highlight_pdf_with_backdrop(input_path: str, output_path: str, targets: List[str], rgb_fill: tuple, opacity_val: float):
-    doc = fitz.open(input_path)
-    for page in doc:
-        for t in targets:
-            if not t.strip():
-                continue
-            rects = page.search_for(t)
-            for r in rects:
-                r_inflated = fitz.Rect(r.x0 - 1, r.y0 - 0.5, r.x1 + 1, r.y1 + 0.5)
-                annot = page.add_rect_annot(r_inflated)
-                annot.set_colors(stroke=None, fill=rgb_fill)
-                annot.set_opacity(opacity_val)
-                annot.update()
-    doc.save(output_path, incremental=False, encryption=fitz.PDF_ENCRYPT_KEEP)
-    doc.close()
+# ---------- WARM-UP ----------
+# Once per session, in the background, so the first "Process PDFs" click
+# skips the cold DNS + TLS handshake without delaying the page render
+if "groq_warmed" not in st.session_state:
+    st.session_state["groq_warmed"] = True
+    try:
+        warm_key = st.secrets["groq"]["api_key"]
+    except (KeyError, FileNotFoundError):
+        warm_key = None  # reported when the user clicks "Process PDFs"
+    if warm_key:
+        threading.Thread(target=_warm_groq, args=(warm_key,), daemon=True).start()
 
 # ---------- MAIN ----------
 if process:
@@ -87,44 +378,52 @@ if process:
         api_key = st.secrets["groq"]["api_key"]
         rgb = color_to_rgb_tuple(color_choice)
 
-        for uploaded in uploaded_files:
-            st.info(f"Processing {uploaded.name}...")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_in:
-                tmp_in.write(uploaded.read())
-                tmp_in.flush()
-
-                # Extract full text from PDF pages
-                doc = fitz.open(tmp_in.name)
-                all_text = []
-                for p in doc:
-                    try:
-                        all_text.append(p.get_text("text"))
-                    except Exception:
-                        pass
-                doc.close()
-
-                # Send entire text to LLM (no regex extraction)
-                text_for_model = "\n".join(all_text)[:5000]
-
-                st.text_area("Full extracted text", text_for_model, height=250)
-
-                companies = call_groq_via_litellm(text_for_model, api_key)
-                st.text_area("Detected companies (list)", str(companies), height=150)
-
-                if not companies:
-                    st.warning(f"No company names detected for {uploaded.name}.")
-                    continue
-
-                st.write(f"**Detected companies:** {', '.join(companies)}")
-
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_out:
-                    highlight_pdf_with_backdrop(tmp_in.name, tmp_out.name, companies, rgb, opacity)
-                    with open(tmp_out.name, "rb") as f:
-                        st.download_button(
-                            label=f"Download highlighted {uploaded.name}",
-                            data=f,
-                            file_name=f"highlighted_{uploaded.name}",
-                            mime="application/pdf",
-                        )
+        st.info(f"Processing {len(uploaded_files)} PDF(s)...")
+        names = [u.name for u in uploaded_files]
+        pdfs = [u.getvalue() for u in uploaded_files]
+        # One slot per file in upload order, filled in as each file finishes
+        slots = [st.empty() for _ in names]
+        for slot, name in zip(slots, names):
+            slot.caption(f"{name}: extracting text...")
+        # PyMuPDF runs in worker processes; threads here only wait on the
+        # cache / pool so every file is worked on in parallel
+        digests = [hashlib.sha256(data).hexdigest() for data in pdfs]
+        with ThreadPoolExecutor(max_workers=min(32, len(pdfs))) as ex:
+            # One unreadable upload (encrypted, not a PDF) fails only its own slot
+            extracted, read_errors = [], {}
+            for i, future in enumerate([ex.submit(_cached_pdf_extract, d, data) for d, data in zip(digests, pdfs)]):
+                try:
+                    extracted.append(future.result())
+                except Exception as e:
+                    extracted.append(("", 0))
+                    read_errors[i] = f"Could not read {names[i]}: {e}"
+            texts = [text_for_model(text) for text, _ in extracted]
+            # The batched Groq calls are often the longest wait
+            for i, slot in enumerate(slots):
+                if i not in read_errors:
+                    slot.caption(f"{names[i]}: detecting companies...")
+            detected = [(dedupe_targets(companies), error) for companies, error in extract_companies(texts, api_key)]
+            for i, error in read_errors.items():
+                detected[i] = ([], error)
+
+            futures = {}
+            for i, (companies, error) in enumerate(detected):
+                if companies:
+                    futures[ex.submit(highlight_job, pdfs[i], extracted[i][1], companies, rgb, opacity)] = i
+                    slots[i].caption(f"{names[i]}: highlighting...")
+                else:
+                    # Nothing to highlight, report straight away
+                    with slots[i].container():
+                        render_result(names[i], texts[i], companies, error, None)
+
+            for future in as_completed(futures):
+                i = futures[future]
+                companies, error = detected[i]
+                try:
+                    pdf_out = future.result()
+                except Exception as e:
+                    pdf_out, error = None, f"Highlighting failed for {names[i]}: {e}"
+                with slots[i].container():
+                    render_result(names[i], texts[i], companies, error, pdf_out)
 
         st.success("✅ Done processing all PDFs.")
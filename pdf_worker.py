@@ -0,0 +1,283 @@
+# PyMuPDF work for app.py. Kept free of Streamlit so these functions can be
+# pickled into ProcessPoolExecutor workers.
+import re
+import string
+import functools
+import unicodedata
+import fitz  # PyMuPDF
+import ahocorasick
+from typing import List
+
+# Text extraction flags: no TEXT_PRESERVE_IMAGES, so rawdict/blocks never
+# decode embedded images (CV headshots), and no TEXT_PRESERVE_LIGATURES, so
+# ligature glyphs come out as their separate letters
+_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+# Punctuation ends a word for the fallback's boundary check, as non-alnum
+# chars do for the sweep, so "Globex," still counts as the word "Globex"
+_WORD_DELIMITERS = string.punctuation
+
+# Headings that open and close a work-history section, shared with app.py's
+# extract_experience_section. Both must start a line, and the opening one must
+# be the whole line, so neither "Experienced developer..." in a summary nor a
+# "Career Objective" heading opens it, and "led skills training" inside
+# Experience does not cut it short
+SECTION_START_RE = re.compile(
+    r"^[ \t]*(?:(?:work|professional|relevant)[ \t]+)?"
+    r"(?:experiences?|work[ \t]+history|employment(?:[ \t]+history)?|career[ \t]+history)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+SECTION_END_RE = re.compile(r"^\s*(?:education|skills|projects|references)\b", re.IGNORECASE | re.MULTILINE)
+
+# Bounds on what a sloppy model reply can cost the sweep: single characters
+# are never employer names, and past the cap the rest is dropped. Two chars
+# stay ("HP", "EY", "3M"); matching is whole-word, so they cannot hit inside
+# longer words
+_MIN_TARGET_CHARS = 2
+_MAX_TARGETS = 64
+
+# ---------- HELPERS ----------
+def dedupe_targets(targets: List[str]) -> List[str]:
+    """Drop too-short and case-insensitive duplicate targets; keep the longest `_MAX_TARGETS`."""
+    seen = {}
+    for t in targets:
+        t = " ".join(t.split())
+        if len(t) >= _MIN_TARGET_CHARS and t.lower() not in seen:
+            seen[t.lower()] = t
+    return sorted(seen.values(), key=len, reverse=True)[:_MAX_TARGETS]
+
+@functools.lru_cache(maxsize=None)
+def _fold_char(c: str) -> str:
+    """Case- and accent-insensitive form of one char; ligatures such as "ﬁ" expand to "fi"."""
+    return "".join(x for x in unicodedata.normalize("NFKD", c).lower() if not unicodedata.combining(x))
+
+def _fold_phrase(target: str) -> str:
+    # Collapse inner whitespace (page lines are joined with "\n", so matches
+    # never span lines) and fold per char, exactly as _page_chars does
+    return "".join(_fold_char(c) for c in " ".join(target.split()))
+
+def _build_automaton(phrases) -> "ahocorasick.Automaton":
+    """Aho-Corasick automaton over already-folded, non-empty phrases."""
+    automaton = ahocorasick.Automaton()
+    for phrase in phrases:
+        automaton.add_word(phrase, phrase)
+    automaton.make_automaton()
+    return automaton
+
+def _page_chars(page) -> tuple:
+    """Folded page text from `rawdict` plus the bbox of every character in it."""
+    chars, boxes = [], []
+    for block in page.get_text("rawdict", flags=_TEXT_FLAGS)["blocks"]:
+        for line in block.get("lines", ()):
+            for span in line["spans"]:
+                for ch in span["chars"]:
+                    # Folding can lengthen a char; every piece keeps the source bbox
+                    for c in _fold_char(ch["c"]):
+                        chars.append(c)
+                        boxes.append(ch["bbox"])
+            chars.append("\n")
+            boxes.append(None)
+    return "".join(chars), boxes
+
+def _target_rects(page, automaton, found: set, rejected: set) -> List["fitz.Rect"]:
+    """Find every target on `page` in one linear sweep of its text.
+
+    Matched phrases are added to `found`; phrases seen only inside longer
+    words are added to `rejected`.
+    """
+    text, boxes = _page_chars(page)
+    spans = []
+    for end, phrase in automaton.iter(text):
+        start = end - len(phrase) + 1
+        # Whole words only, so "Meta" does not light up "metadata"
+        if (start > 0 and text[start - 1].isalnum()) or (end + 1 < len(text) and text[end + 1].isalnum()):
+            rejected.add(phrase)
+            continue
+        spans.append((start, end))
+        found.add(phrase)
+
+    # Longest match wins where targets overlap ("Google" inside "Google Inc."),
+    # so the same glyphs are never annotated twice
+    rects = []
+    last_end = -1
+    for start, end in sorted(spans, key=lambda s: (s[0], -s[1])):
+        if start <= last_end:
+            continue
+        last_end = end
+        r = fitz.Rect(boxes[start])
+        for box in boxes[start + 1:end + 1]:
+            r.include_rect(box)
+        rects.append(r)
+    return rects
+
+def _merge_rects(rects: List["fitz.Rect"], gap: float = 2.0) -> List["fitz.Rect"]:
+    """Drop exact duplicates, then fuse rects on the same baseline that touch or nearly touch."""
+    unique = {(round(r.x0, 1), round(r.y0, 1), round(r.x1, 1), round(r.y1, 1)): r for r in rects}
+    rows = {}
+    for r in unique.values():
+        rows.setdefault(round(r.y0, 1), []).append(r)
+
+    merged = []
+    for row in rows.values():
+        row.sort(key=lambda r: r.x0)
+        cur = fitz.Rect(row[0])
+        for r in row[1:]:
+            if r.x0 - cur.x1 < gap:
+                cur = fitz.Rect(cur.x0, min(cur.y0, r.y0), max(cur.x1, r.x1), max(cur.y1, r.y1))
+            else:
+                merged.append(cur)
+                cur = fitz.Rect(r)
+        merged.append(cur)
+    return merged
+
+def _target_phrases(targets: List[str]) -> dict:
+    """Map each folded, non-empty phrase to the target it came from."""
+    phrases = {_fold_phrase(t): t for t in targets}
+    phrases.pop("", None)
+    return phrases
+
+def missing_targets(targets: List[str], found: set, rejected: set) -> List[str]:
+    """Targets the automaton sweep never saw at all, not even inside a longer word."""
+    return [t for phrase, t in _target_phrases(targets).items() if phrase not in found and phrase not in rejected]
+
+def find_target_rects(doc: "fitz.Document", page_numbers, targets: List[str]) -> tuple:
+    """Sweep the given pages; return `({page_number: rects}, matched phrases, rejected phrases)`."""
+    phrases = _target_phrases(targets)
+    found, rejected = set(), set()
+    if not phrases:
+        return {}, found, rejected
+    # One text-layer walk per page instead of one search_for per target
+    automaton = _build_automaton(phrases)
+    page_rects = {pno: _target_rects(doc[pno], automaton, found, rejected) for pno in page_numbers}
+    return page_rects, found, rejected
+
+def _on_word_edges(rect: "fitz.Rect", words: list, tol: float = 0.5) -> bool:
+    """True if `rect` starts where a word starts and ends where a word ends, on the same line."""
+    line = [w for w in words if w[1] < rect.y1 and rect.y0 < w[3]]
+    return any(abs(w[0] - rect.x0) <= tol for w in line) and any(abs(w[2] - rect.x1) <= tol for w in line)
+
+def draw_backdrops(doc: "fitz.Document", page_rects: dict, missing: List[str], rgb_fill: tuple, opacity_val: float) -> None:
+    """Fill `page_rects` over the text, plus search_for hits for `missing` targets."""
+    # MuPDF's own search only for targets the sweep never hit anywhere,
+    # e.g. text whose extracted form differs from the model's spelling
+    if missing:
+        for pno in range(doc.page_count):
+            page = doc[pno]
+            # One layout parse per page shared by every missing target
+            tp = page.get_textpage(flags=_TEXT_FLAGS | fitz.TEXT_DEHYPHENATE)
+            hits = [r for t in missing for r in page.search_for(t, textpage=tp)]
+            if hits:
+                # search_for has no word boundaries; keep the sweep's whole-word rule
+                words = page.get_text("words", textpage=tp, delimiters=_WORD_DELIMITERS)
+                page_rects.setdefault(pno, []).extend(r for r in hits if _on_word_edges(r, words))
+            tp = None
+
+    # Module attribute and padding as locals for the per-rect inner loop
+    _dx, _dy, _Rect = 1.0, 0.5, fitz.Rect
+    for pno, rects in page_rects.items():
+        if not rects:
+            continue
+        # One translucent filled path per page, over the text like the old
+        # annotations, so opaque template backgrounds cannot hide it
+        shape = doc[pno].new_shape()
+        for r in _merge_rects([_Rect(r) for r in rects]):
+            shape.draw_rect(_Rect(r.x0 - _dx, r.y0 - _dy, r.x1 + _dx, r.y1 + _dy))
+        shape.finish(color=None, fill=rgb_fill, fill_opacity=opacity_val)
+        shape.commit(overlay=True)
+
+def highlight_pdf_with_backdrop(doc: "fitz.Document", targets: List[str], rgb_fill: tuple, opacity_val: float) -> None:
+    """Fill a translucent backdrop over every target on an already-open Document, in place."""
+    page_rects, found, rejected = find_target_rects(doc, range(doc.page_count), targets)
+    if page_rects:
+        draw_backdrops(doc, page_rects, missing_targets(targets, found, rejected), rgb_fill, opacity_val)
+
+def doc_text(doc: "fitz.Document") -> str:
+    """Return the text app.py sends to the model, reading only as many pages as needed.
+
+    Pages are read from the first one with a work-history heading. A section
+    closes at the next section header that follows some of its own text, and
+    reading stops at the first page after that which opens no new section; every
+    page is returned if there is no work-history heading at all.
+    """
+    pages = []
+    start = None
+    in_section = content = False
+    for p in doc:
+        try:
+            # block[6] == 0 keeps text blocks only
+            text = "\n".join(b[4] for b in p.get_text("blocks", flags=_TEXT_FLAGS) if b[6] == 0)
+        except Exception:
+            continue
+        pages.append(text)
+        pos = 0
+        opened = False
+        # search(text, pos) rather than slices, so ^ still means a real line start
+        while True:
+            if not in_section:
+                heading = SECTION_START_RE.search(text, pos)
+                if heading is None:
+                    break
+                if start is None:
+                    start = len(pages) - 1
+                in_section, content, opened, pos = True, False, True, heading.end()
+            end = SECTION_END_RE.search(text, pos)
+            # A closing heading only counts once the section has text of its own
+            if text[pos:end.start() if end else len(text)].strip():
+                content = True
+            if end is None:
+                break
+            if content:
+                in_section = False
+            pos = end.end()
+        # Past a closed section, keep reading only while pages open another
+        # one ("Experience" on page 1, "Employment History" on page 2)
+        if start is not None and not in_section and not opened:
+            break
+    return "\n".join(pages if start is None else pages[start:])
+
+# ---------- PROCESS POOL ENTRY POINTS ----------
+# Each call parses the PDF exactly once and hands back plain bytes/str/tuples.
+
+def _close(doc: "fitz.Document") -> None:
+    # Pool workers live for the whole server, so empty MuPDF's process-wide
+    # store (fonts, glyphs, images) instead of letting it grow per document
+    doc.close()
+    fitz.TOOLS.store_shrink(100)
+
+def _to_bytes(doc: "fitz.Document") -> bytes:
+    # Only streams stored uncompressed get deflated; JPEG/Flate images and
+    # fonts are written as they are, so this never re-encodes them
+    out_bytes = doc.tobytes(
+        garbage=4,
+        deflate=True,
+        deflate_images=True,
+        deflate_fonts=True,
+        clean=True,
+        encryption=fitz.PDF_ENCRYPT_KEEP,
+    )
+    _close(doc)
+    return out_bytes
+
+def extract_pdf_text(pdf_bytes: bytes) -> tuple:
+    """Return `(text for the model, page count)`."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    result = doc_text(doc), doc.page_count
+    _close(doc)
+    return result
+
+def highlight_pdf_bytes(pdf_bytes: bytes, targets: List[str], rgb_fill: tuple, opacity_val: float) -> bytes:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    highlight_pdf_with_backdrop(doc, targets, rgb_fill, opacity_val)
+    return _to_bytes(doc)
+
+def find_rects_in_pages(pdf_bytes: bytes, page_numbers: List[int], targets: List[str]) -> tuple:
+    """Chunk worker for large PDFs: `find_target_rects` with rects as plain tuples."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_rects, found, rejected = find_target_rects(doc, page_numbers, targets)
+    _close(doc)
+    return {pno: [tuple(r) for r in rects] for pno, rects in page_rects.items()}, found, rejected
+
+def draw_backdrops_bytes(pdf_bytes: bytes, page_rects: dict, missing: List[str], rgb_fill: tuple, opacity_val: float) -> bytes:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    draw_backdrops(doc, page_rects, missing, rgb_fill, opacity_val)
+    return _to_bytes(doc)